@@ -0,0 +1,71 @@
+"""Convert stored page sections to the current storage format.
+
+Runs across all tenants.
+
+Usage: python compact_sections.py [--threshold BYTES] [--decompress] [--dry-run]
+"""
+import argparse
+import asyncio
+import time
+import zlib
+
+from server import client, raw_db, pack_sections, unpack_sections, SECTIONS_COMPRESS_THRESHOLD
+
+
+async def migrate(threshold: int, compress: bool, dry_run: bool):
+    pages = converted = skipped = 0
+    before_bytes = after_bytes = 0
+    decode_ms = 0.0
+    decoded = 0
+
+    async for page in raw_db.pages.find({}, {'_id': 0}):
+        pages += 1
+        before_bytes += page.get('sections_stored_size') or page.get('sections_size') or 0
+        page = unpack_sections(page)
+        fields = pack_sections(page.get('sections') or [], compress=compress, threshold=threshold)
+        if not page.get('sections_size'):
+            before_bytes += fields['sections_size']
+        after_bytes += fields['sections_stored_size']
+
+        if fields['sections_zlib'] is not None:
+            start = time.perf_counter()
+            zlib.decompress(fields['sections_zlib'])
+            decode_ms += (time.perf_counter() - start) * 1000
+            decoded += 1
+
+        if not dry_run:
+            # Every page edit bumps updated_at, so a page saved since it was read
+            # is left alone rather than overwritten with its old sections
+            result = await raw_db.pages.update_one(
+                {'id': page['id'], 'updated_at': page.get('updated_at')},
+                {'$set': fields}
+            )
+            if result.matched_count == 0:
+                skipped += 1
+                continue
+        converted += 1
+
+    print(f"Pages scanned:      {pages}")
+    print(f"Pages {'to convert' if dry_run else 'converted'}:   {converted}")
+    if skipped:
+        print(f"Pages skipped:      {skipped} (edited during the run, rerun to convert)")
+    print(f"Sections bytes:     {before_bytes} -> {after_bytes} ({before_bytes - after_bytes} saved)")
+    if decoded:
+        print(f"Avg decompress:     {decode_ms / decoded:.3f} ms over {decoded} compressed pages")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threshold', type=int, default=SECTIONS_COMPRESS_THRESHOLD)
+    parser.add_argument('--decompress', action='store_true', help="store every page's sections uncompressed")
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(migrate(args.threshold, not args.decompress, args.dry_run))
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
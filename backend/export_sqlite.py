@@ -0,0 +1,70 @@
+"""Copy the Mongo database into a SQLite file for embedded or edge deployments.
+
+Serve the result with STORAGE_BACKEND=sqlite SQLITE_PATH=<file> (and
+SQLITE_READ_ONLY=true for read-only replicas). By default only public site
+content is exported; --include-private also copies admin users, messages,
+leads, analytics and request profiles, for a full standalone copy.
+
+Usage: python export_sqlite.py <output.sqlite3> [--include-private] [--batch-size N]
+"""
+import argparse
+import asyncio
+import os
+
+from server import client, raw_db, STORAGE_BACKEND, TENANT_COLLECTIONS, PROFILE_COLLECTION_MAX_DOCS
+from storage import SQLiteDatabase
+
+PUBLIC_COLLECTIONS = {'pages', 'portfolio', 'content', 'navigation', 'social_links', 'settings', 'tenants'}
+PRIVATE_COLLECTIONS = (TENANT_COLLECTIONS | {'tenants'}) - PUBLIC_COLLECTIONS
+
+
+async def export(path: str, batch_size: int, include_private: bool):
+    if os.path.exists(path):
+        raise SystemExit(f"{path} already exists; export into a new file and swap it in")
+    target = SQLiteDatabase(path)
+    try:
+        for name in sorted(PUBLIC_COLLECTIONS | (PRIVATE_COLLECTIONS if include_private else set())):
+            source = raw_db[name]
+            if name == 'request_profiles':
+                await target.create_collection(name, capped=True, max=PROFILE_COLLECTION_MAX_DOCS)
+
+            copied = 0
+            batch = []
+            async for document in source.find({}, {'_id': 0}):
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    await target[name].insert_many(batch)
+                    copied += len(batch)
+                    batch = []
+            if batch:
+                await target[name].insert_many(batch)
+                copied += len(batch)
+
+            indexes = 0
+            for index_name, index in (await source.index_information()).items():
+                if index_name == '_id_':
+                    continue
+                await target[name].create_index(index['key'], unique=index.get('unique', False))
+                indexes += 1
+            print(f"{name:<20} {copied:>8} documents, {indexes} indexes")
+    finally:
+        target.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--include-private', action='store_true', help="also copy users, messages, leads, analytics and profiles")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    if STORAGE_BACKEND != 'mongo':
+        raise SystemExit("Run the export with STORAGE_BACKEND=mongo")
+
+    try:
+        asyncio.run(export(args.path, args.batch_size, args.include_private))
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
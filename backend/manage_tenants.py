@@ -0,0 +1,80 @@
+"""Create, update and list the sites served by a multi-tenant deployment.
+
+Usage:
+    python manage_tenants.py list
+    python manage_tenants.py set <tenant_id> --host acme.com [--host www.acme.com] [--name Acme]
+                                 [--site-url https://www.acme.com] [--max-concurrency 10]
+    python manage_tenants.py remove <tenant_id>
+"""
+import argparse
+import asyncio
+
+from server import client, raw_db
+
+
+async def list_tenants():
+    async for tenant in raw_db.tenants.find({}, {'_id': 0}).sort('id', 1):
+        limit = tenant.get('max_concurrent_requests') or 'default'
+        print(
+            f"{tenant['id']:<24} {', '.join(tenant.get('hosts', [])):<48} "
+            f"site_url={tenant.get('site_url') or 'default'} max_concurrency={limit}"
+        )
+
+
+async def set_tenant(tenant_id: str, hosts, name, site_url, max_concurrency):
+    # Hosts are uniquely indexed, so every tenant needs its own from the start
+    if not hosts and not await raw_db.tenants.find_one({'id': tenant_id}):
+        raise SystemExit(f"Tenant {tenant_id} does not exist yet; give at least one --host")
+
+    # Only overwrite what was passed, so updating one setting keeps the rest
+    update = {}
+    if name:
+        update['name'] = name
+    if hosts:
+        update['hosts'] = [host.lower() for host in hosts]
+    if site_url:
+        update['site_url'] = site_url.rstrip('/')
+    if max_concurrency is not None:
+        update['max_concurrent_requests'] = max_concurrency
+    operations = {'$set': update} if update else {}
+    if not name:
+        operations['$setOnInsert'] = {'name': tenant_id}
+    await raw_db.tenants.update_one({'id': tenant_id}, operations, upsert=True)
+    print(f"Tenant {tenant_id} saved")
+
+
+async def remove_tenant(tenant_id: str):
+    # Content stays in place; the site just stops resolving
+    result = await raw_db.tenants.delete_one({'id': tenant_id})
+    print(f"Tenant {tenant_id} {'removed' if result.deleted_count else 'not found'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list')
+    set_parser = commands.add_parser('set')
+    set_parser.add_argument('tenant_id')
+    set_parser.add_argument('--host', action='append', dest='hosts')
+    set_parser.add_argument('--name')
+    set_parser.add_argument('--site-url', help="canonical URL for sitemaps and feeds (default https://<first host>)")
+    set_parser.add_argument('--max-concurrency', type=int)
+    remove_parser = commands.add_parser('remove')
+    remove_parser.add_argument('tenant_id')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        task = list_tenants()
+    elif args.command == 'set':
+        task = set_tenant(args.tenant_id, args.hosts, args.name, args.site_url, args.max_concurrency)
+    else:
+        task = remove_tenant(args.tenant_id)
+
+    try:
+        asyncio.run(task)
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
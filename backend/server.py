@@ -1,25 +1,152 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, CollectionInvalid
 import os
+import asyncio
+import contextvars
+import cProfile
+import io
+import pstats
+import random
+import time
+import zlib
+import hashlib
+import heapq
+import itertools
+import json
+from email.utils import format_datetime
+from urllib.parse import parse_qs
+from xml.sax.saxutils import escape
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, AsyncIterator, Callable
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 import jwt
 import bcrypt
 
+from storage import SQLiteDatabase, ReadOnlyStorageError
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Mongo commands issued while a request is being profiled. Motor copies the
+# context into its executor threads, so the listener sees the request's list.
+# With a listener attached pymongo builds a started and a finished event per
+# command; together with the early return below that measured ~2us per command,
+# well under a round trip. PROFILE_MONGO_COMMANDS=false leaves it uninstalled.
+PROFILE_MONGO_COMMANDS = os.environ.get('PROFILE_MONGO_COMMANDS', 'true').lower() in ('1', 'true', 'yes')
+profiled_commands: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar(
+    'profiled_commands', default=None
+)
+
+class ProfilingCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def _record(self, event, ok: bool):
+        commands = profiled_commands.get()
+        if commands is None:
+            return
+        commands.append({
+            'command': event.command_name,
+            'database': event.database_name,
+            'duration_ms': event.duration_micros / 1000,
+            'ok': ok
+        })
+
+    def succeeded(self, event):
+        self._record(event, True)
+
+    def failed(self, event):
+        self._record(event, False)
+
+# Multi-tenancy. Every tenant-owned document carries a tenant_id, and handlers
+# reach those collections through TenantCollection, which adds the current
+# request's tenant to every filter, inserted document, pipeline and index.
+MULTI_TENANT = os.environ.get('MULTI_TENANT', 'false').lower() in ('1', 'true', 'yes')
+DEFAULT_TENANT_ID = 'default'
+TENANT_COLLECTIONS = {
+    'users', 'pages', 'portfolio', 'content', 'navigation', 'social_links',
+    'messages', 'leads', 'settings', 'analytics_rollups', 'request_profiles'
+}
+
+current_tenant: contextvars.ContextVar[str] = contextvars.ContextVar('current_tenant', default=DEFAULT_TENANT_ID)
+# Canonical URL of the current tenant's site, used for sitemap and feed links
+current_site_url: contextvars.ContextVar[str] = contextvars.ContextVar('current_site_url', default='')
+
+class TenantCollection:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def _scope(self, query: Optional[dict] = None) -> dict:
+        return {**(query or {}), 'tenant_id': current_tenant.get()}
+
+    def find(self, query: Optional[dict] = None, *args, **kwargs):
+        return self.collection.find(self._scope(query), *args, **kwargs)
+
+    async def find_one(self, query: Optional[dict] = None, *args, **kwargs):
+        return await self.collection.find_one(self._scope(query), *args, **kwargs)
+
+    async def count_documents(self, query: dict, **kwargs):
+        return await self.collection.count_documents(self._scope(query), **kwargs)
+
+    async def insert_one(self, document: dict, **kwargs):
+        document['tenant_id'] = current_tenant.get()
+        return await self.collection.insert_one(document, **kwargs)
+
+    async def insert_many(self, documents: List[dict], **kwargs):
+        for document in documents:
+            document['tenant_id'] = current_tenant.get()
+        return await self.collection.insert_many(documents, **kwargs)
+
+    async def update_one(self, query: dict, update: dict, **kwargs):
+        return await self.collection.update_one(self._scope(query), update, **kwargs)
+
+    async def delete_one(self, query: dict, **kwargs):
+        return await self.collection.delete_one(self._scope(query), **kwargs)
+
+    def aggregate(self, pipeline: List[dict], **kwargs):
+        return self.collection.aggregate([{'$match': self._scope()}, *pipeline], **kwargs)
+
+    async def create_index(self, keys, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        return await self.collection.create_index([('tenant_id', 1), *keys], **kwargs)
+
+class TenantDatabase:
+    def __init__(self, database):
+        self.database = database
+
+    def __getattr__(self, name: str):
+        if name in TENANT_COLLECTIONS:
+            return TenantCollection(self.database[name])
+        return getattr(self.database, name)
+
+# Storage backend. "mongo" (default) uses Motor; "sqlite" serves everything from
+# a local file, optionally read-only for edge replicas built by export_sqlite.py.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+STORAGE_READ_ONLY = os.environ.get('SQLITE_READ_ONLY', 'false').lower() in ('1', 'true', 'yes')
+
+if STORAGE_BACKEND == 'sqlite':
+    client = SQLiteDatabase(os.environ.get('SQLITE_PATH', str(ROOT_DIR / 'ima.sqlite3')), read_only=STORAGE_READ_ONLY)
+    raw_db = client
+else:
+    STORAGE_READ_ONLY = False
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(
+        mongo_url,
+        event_listeners=[ProfilingCommandListener()] if PROFILE_MONGO_COMMANDS else []
+    )
+    raw_db = client[os.environ['DB_NAME']]
+db = TenantDatabase(raw_db)
 
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'ima-portfolio-secret-key-change-in-production')
@@ -262,6 +389,127 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# =============== ANALYTICS HELPERS ===============
+
+# Views are counted in memory per worker and written out as bulk $inc upserts
+# into hourly and daily rollup documents. At most ANALYTICS_FLUSH_SECONDS of
+# views (or ANALYTICS_MAX_PENDING distinct keys) are lost if a worker dies.
+# Failed upserts are retried with exponential backoff (up to
+# ANALYTICS_MAX_BACKOFF_SECONDS). While retrying, the buffer holds at most
+# ANALYTICS_MAX_PENDING keys, and views for new keys are dropped and counted.
+ANALYTICS_FLUSH_SECONDS = float(os.environ.get('ANALYTICS_FLUSH_SECONDS', '10'))
+ANALYTICS_MAX_PENDING = int(os.environ.get('ANALYTICS_MAX_PENDING', '5000'))
+ANALYTICS_MAX_BACKOFF_SECONDS = float(os.environ.get('ANALYTICS_MAX_BACKOFF_SECONDS', '300'))
+
+def hour_bucket(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+class ViewAggregator:
+    def __init__(self, flush_seconds: float, max_pending: int, enabled: bool = True):
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.enabled = enabled
+        # Raw views keyed by hour, and rollup increments whose upsert failed
+        self.pending: Dict[Tuple[str, str, str, datetime], int] = {}
+        self.retry: Dict[Tuple[str, str, str, str, datetime], int] = {}
+        self.dropped = 0
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Task] = None
+
+    def buffered(self) -> int:
+        return len(self.pending) + len(self.retry)
+
+    def backing_off(self) -> bool:
+        return time.monotonic() < self._retry_at
+
+    def record(self, kind: str, item_id: str):
+        if not self.enabled:
+            return
+        key = (current_tenant.get(), kind, item_id, hour_bucket(datetime.now(timezone.utc)))
+        if key not in self.pending and self.buffered() >= self.max_pending:
+            if self.backing_off() or (self._flushing is not None and not self._flushing.done()):
+                self.dropped += 1
+                return
+            self._flushing = asyncio.ensure_future(self.flush())
+        self.pending[key] = self.pending.get(key, 0) + 1
+
+    def _requeue(self, counts: List[Tuple[Tuple[str, str, str, str, datetime], int]]):
+        for key, views in counts:
+            if key in self.retry or self.buffered() < self.max_pending:
+                self.retry[key] = self.retry.get(key, 0) + views
+            else:
+                self.dropped += views
+
+    def _failed(self):
+        self._backoff = min(max(self._backoff * 2, self.flush_seconds), ANALYTICS_MAX_BACKOFF_SECONDS)
+        self._retry_at = time.monotonic() + self._backoff
+
+    async def flush(self) -> int:
+        # Swap the buffers out first so views recorded during the write land in the next batch
+        batch, self.pending = self.pending, {}
+        counts, self.retry = self.retry, {}
+        if not batch and not counts:
+            return 0
+
+        for (tenant_id, kind, item_id, hour), views in batch.items():
+            day = hour.replace(hour=0)
+            for granularity, bucket in (('hour', hour), ('day', day)):
+                key = (tenant_id, kind, item_id, granularity, bucket)
+                counts[key] = counts.get(key, 0) + views
+
+        # Flushes run outside any request, so the tenant is set explicitly per upsert
+        items = list(counts.items())
+        operations = [
+            UpdateOne(
+                {'tenant_id': tenant_id, 'kind': kind, 'item_id': item_id, 'granularity': granularity, 'bucket': bucket},
+                {'$inc': {'views': views}},
+                upsert=True
+            )
+            for (tenant_id, kind, item_id, granularity, bucket), views in items
+        ]
+        try:
+            await raw_db.analytics_rollups.bulk_write(operations, ordered=False)
+        except BulkWriteError as exc:
+            # Unordered bulk writes apply every other upsert, so only the failed ones are retried
+            failed = {error['index'] for error in exc.details.get('writeErrors', [])}
+            logger.error("Failed to flush %d of %d analytics rollups, retrying", len(failed), len(operations))
+            self._requeue([items[index] for index in sorted(failed)])
+            self._failed()
+            return len(operations) - len(failed)
+        except Exception:
+            # Nothing is known to have been applied, so the whole batch is retried
+            self._requeue(items)
+            self._failed()
+            logger.exception("Failed to flush %d analytics rollups, retrying in %.0fs", len(operations), self._backoff)
+            return 0
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        return len(operations)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            if not self.backing_off():
+                await self.flush()
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+view_aggregator = ViewAggregator(ANALYTICS_FLUSH_SECONDS, ANALYTICS_MAX_PENDING, enabled=not STORAGE_READ_ONLY)
+
 # =============== AUTH ENDPOINTS ===============
 
 @api_router.post("/auth/register", response_model=TokenResponse)
@@ -323,19 +571,72 @@ async def get_me(user: dict = Depends(get_current_user)):
         created_at=user['created_at']
     )
 
+# =============== PAGE SECTIONS STORAGE ===============
+
+# With SECTIONS_COMPRESSION enabled, section trees whose JSON is larger than
+# SECTIONS_COMPRESS_THRESHOLD bytes are stored zlib-compressed in
+# sections_zlib instead of as a BSON array. Every page carries a sha256 of its
+# canonical sections JSON (sections_hash) whether compressed or not.
+SECTIONS_COMPRESSION = os.environ.get('SECTIONS_COMPRESSION', 'false').lower() in ('1', 'true', 'yes')
+SECTIONS_COMPRESS_THRESHOLD = int(os.environ.get('SECTIONS_COMPRESS_THRESHOLD', '8192'))
+
+# Decompression cost paid by this worker, per tenant
+sections_decode_stats: Dict[str, Dict[str, float]] = {}
+
+def pack_sections(
+    sections: List[Dict[str, Any]],
+    compress: bool = SECTIONS_COMPRESSION,
+    threshold: int = SECTIONS_COMPRESS_THRESHOLD
+) -> Dict[str, Any]:
+    raw = json.dumps(sections, separators=(',', ':')).encode('utf-8')
+    canonical = json.dumps(sections, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    fields = {
+        'sections_hash': hashlib.sha256(canonical).hexdigest(),
+        'sections_size': len(raw)
+    }
+    if compress and len(raw) > threshold:
+        packed = zlib.compress(raw, 6)
+        fields.update({'sections': None, 'sections_zlib': packed, 'sections_stored_size': len(packed)})
+    else:
+        fields.update({'sections': sections, 'sections_zlib': None, 'sections_stored_size': len(raw)})
+    return fields
+
+def unpack_sections(page: dict) -> dict:
+    packed = page.pop('sections_zlib', None)
+    if packed is not None:
+        start = time.perf_counter()
+        page['sections'] = json.loads(zlib.decompress(packed))
+        stats = sections_decode_stats.setdefault(current_tenant.get(), {'count': 0, 'total_ms': 0.0})
+        stats['count'] += 1
+        stats['total_ms'] += (time.perf_counter() - start) * 1000
+    return page
+
+def page_etag(page: dict) -> Optional[str]:
+    if not page.get('sections_hash'):
+        return None
+    return f'"{page["sections_hash"][:16]}-{page["updated_at"]}"'
+
 # =============== PAGES ENDPOINTS ===============
 
 @api_router.get("/pages", response_model=List[PageResponse])
 async def get_pages(published_only: bool = False):
     query = {'is_published': True} if published_only else {}
     pages = await db.pages.find(query, {'_id': 0}).to_list(100)
-    return pages
+    return [unpack_sections(page) for page in pages]
 
 @api_router.get("/pages/{slug}", response_model=PageResponse)
-async def get_page(slug: str):
+async def get_page(slug: str, request: Request):
     page = await db.pages.find_one({'slug': slug}, {'_id': 0})
     if not page:
         raise HTTPException(status_code=404, detail="Page not found")
+    view_aggregator.record('page', page['id'])
+    # Unchanged pages are answered from the content hash without decompressing sections
+    etag = page_etag(page)
+    if etag and request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers={'ETag': etag})
+    page = unpack_sections(page)
+    if etag:
+        return JSONResponse(PageResponse(**page).model_dump(), headers={'ETag': etag})
     return page
 
 @api_router.post("/pages", response_model=PageResponse)
@@ -350,12 +651,13 @@ async def create_page(data: PageCreate, user: dict = Depends(get_current_user)):
     page_doc = {
         'id': page_id,
         **data.model_dump(),
+        **pack_sections(data.sections),
         'created_at': now,
         'updated_at': now
     }
     
     await db.pages.insert_one(page_doc)
-    return PageResponse(**{k: v for k, v in page_doc.items() if k != '_id'})
+    return PageResponse(**{**page_doc, 'sections': data.sections})
 
 @api_router.put("/pages/{page_id}", response_model=PageResponse)
 async def update_page(page_id: str, data: PageUpdate, user: dict = Depends(get_current_user)):
@@ -364,11 +666,13 @@ async def update_page(page_id: str, data: PageUpdate, user: dict = Depends(get_c
         raise HTTPException(status_code=404, detail="Page not found")
     
     update_data = {k: v for k, v in data.model_dump().items() if v is not None}
+    if 'sections' in update_data:
+        update_data.update(pack_sections(update_data['sections']))
     update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
     
     await db.pages.update_one({'id': page_id}, {'$set': update_data})
     updated = await db.pages.find_one({'id': page_id}, {'_id': 0})
-    return PageResponse(**updated)
+    return PageResponse(**unpack_sections(updated))
 
 @api_router.delete("/pages/{page_id}")
 async def delete_page(page_id: str, user: dict = Depends(get_current_user)):
@@ -397,6 +701,7 @@ async def get_portfolio_item(item_id: str):
     item = await db.portfolio.find_one({'id': item_id}, {'_id': 0})
     if not item:
         raise HTTPException(status_code=404, detail="Portfolio item not found")
+    view_aggregator.record('portfolio', item['id'])
     return item
 
 @api_router.post("/portfolio", response_model=PortfolioResponse)
@@ -580,16 +885,14 @@ async def create_message(data: MessageCreate):
     
     # Add to leads if subscribed
     if data.subscribe_newsletter:
-        existing_lead = await db.leads.find_one({'email': data.email})
-        if not existing_lead:
-            lead_doc = {
-                'id': str(uuid.uuid4()),
-                'email': data.email,
-                'name': data.name,
-                'source': 'contact_form',
-                'created_at': now
-            }
-            await db.leads.insert_one(lead_doc)
+        # Upsert so two submissions racing each other cannot both add the lead
+        lead_doc = {
+            'id': str(uuid.uuid4()),
+            'name': data.name,
+            'source': 'contact_form',
+            'created_at': now
+        }
+        await db.leads.update_one({'email': data.email}, {'$setOnInsert': lead_doc}, upsert=True)
     
     return MessageResponse(**{k: v for k, v in message_doc.items() if k != '_id'})
 
@@ -611,7 +914,7 @@ async def delete_message(message_id: str, user: dict = Depends(get_current_user)
 
 @api_router.get("/leads")
 async def get_leads(user: dict = Depends(get_current_user)):
-    leads = await db.leads.find({}, {'_id': 0}).sort('created_at', -1).to_list(500)
+    leads = await db.leads.find({}, {'_id': 0, 'tenant_id': 0}).sort('created_at', -1).to_list(500)
     return leads
 
 # =============== SETTINGS ENDPOINTS ===============
@@ -671,6 +974,494 @@ async def get_stats(user: dict = Depends(get_current_user)):
         'leads': leads_count
     }
 
+@api_router.get("/stats/sections")
+async def get_sections_stats(user: dict = Depends(get_current_user)):
+    totals = await db.pages.aggregate([
+        {'$group': {
+            '_id': None,
+            'pages': {'$sum': 1},
+            'compressed_pages': {'$sum': {'$cond': [{'$ifNull': ['$sections_zlib', False]}, 1, 0]}},
+            'unmigrated_pages': {'$sum': {'$cond': [{'$ifNull': ['$sections_hash', False]}, 0, 1]}},
+            'raw_bytes': {'$sum': {'$ifNull': ['$sections_size', 0]}},
+            'stored_bytes': {'$sum': {'$ifNull': ['$sections_stored_size', 0]}}
+        }},
+        {'$project': {'_id': 0}}
+    ]).to_list(1)
+    totals = totals[0] if totals else {
+        'pages': 0, 'compressed_pages': 0, 'unmigrated_pages': 0, 'raw_bytes': 0, 'stored_bytes': 0
+    }
+    decode = sections_decode_stats.get(current_tenant.get(), {'count': 0, 'total_ms': 0.0})
+    decoded = decode['count']
+
+    return {
+        'compression_enabled': SECTIONS_COMPRESSION,
+        'threshold_bytes': SECTIONS_COMPRESS_THRESHOLD,
+        **totals,
+        'saved_bytes': totals['raw_bytes'] - totals['stored_bytes'],
+        'ratio': round(totals['stored_bytes'] / totals['raw_bytes'], 4) if totals['raw_bytes'] else None,
+        # Only the decompression overhead is measured (this worker, since start);
+        # read and transfer time saved is not, saved_bytes is the proxy for it
+        'decoded_pages': decoded,
+        'avg_decode_ms': round(decode['total_ms'] / decoded, 3) if decoded else None
+    }
+
+# =============== ANALYTICS ENDPOINTS ===============
+
+@api_router.get("/analytics/views")
+async def get_view_analytics(
+    kind: Optional[str] = None,
+    item_id: Optional[str] = None,
+    granularity: str = 'day',
+    days: int = 30,
+    limit: int = 10,
+    user: dict = Depends(get_current_user)
+):
+    if granularity not in ('hour', 'day'):
+        raise HTTPException(status_code=400, detail="Granularity must be 'hour' or 'day'")
+    if kind is not None and kind not in ('page', 'portfolio'):
+        raise HTTPException(status_code=400, detail="Kind must be 'page' or 'portfolio'")
+    days = max(1, min(days, 366))
+    limit = max(1, min(limit, 100))
+
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    match = {'granularity': granularity, 'bucket': {'$gte': hour_bucket(since)}}
+    if kind:
+        match['kind'] = kind
+
+    top = await db.analytics_rollups.aggregate([
+        {'$match': match},
+        {'$group': {'_id': {'kind': '$kind', 'item_id': '$item_id'}, 'views': {'$sum': '$views'}}},
+        {'$sort': {'views': -1}},
+        {'$limit': limit},
+        {'$project': {'_id': 0, 'kind': '$_id.kind', 'item_id': '$_id.item_id', 'views': 1}}
+    ]).to_list(limit)
+
+    if item_id:
+        match['item_id'] = item_id
+    series = await db.analytics_rollups.aggregate([
+        {'$match': match},
+        {'$group': {'_id': '$bucket', 'views': {'$sum': '$views'}}},
+        {'$sort': {'_id': 1}},
+        {'$project': {'_id': 0, 'bucket': '$_id', 'views': 1}}
+    ]).to_list(None)
+    for point in series:
+        point['bucket'] = point['bucket'].replace(tzinfo=timezone.utc).isoformat()
+
+    return {
+        'granularity': granularity,
+        'since': since.isoformat(),
+        'top': top,
+        'series': series
+    }
+
+# =============== PROFILING ===============
+
+# A request is profiled when an admin sends "X-Profile: 1" (or ?_profile=1),
+# or when it is picked by PROFILE_SAMPLE_RATE. Everything else goes straight
+# through after a header lookup.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_COLLECTION_BYTES = int(os.environ.get('PROFILE_COLLECTION_BYTES', str(16 * 1024 * 1024)))
+PROFILE_COLLECTION_MAX_DOCS = int(os.environ.get('PROFILE_COLLECTION_MAX_DOCS', '5000'))
+PROFILE_TOP_FUNCTIONS = 40
+
+# Fire-and-forget tasks are kept referenced here until they finish
+background_tasks: set = set()
+
+def spawn(coroutine) -> asyncio.Task:
+    task = asyncio.ensure_future(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+class TaskProfiler:
+    # Steps a request's coroutine with the profiler and CPU clock running only
+    # while that coroutine executes. Other requests interleaved on the event
+    # loop run between steps, so they never land in this request's figures.
+    def __init__(self, coroutine):
+        self.coroutine = coroutine
+        self.profiler = cProfile.Profile()
+        self.cpu_seconds = 0.0
+
+    def __await__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def send(self, value):
+        return self._step(self.coroutine.send, value)
+
+    def throw(self, *args):
+        return self._step(self.coroutine.throw, *args)
+
+    def close(self):
+        return self.coroutine.close()
+
+    def _step(self, method, *args):
+        cpu_start = time.thread_time()
+        self.profiler.enable()
+        try:
+            return method(*args)
+        finally:
+            self.profiler.disable()
+            self.cpu_seconds += time.thread_time() - cpu_start
+
+async def is_admin_token(request: Request) -> bool:
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return False
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.InvalidTokenError:
+        return False
+    # Same check as get_current_user, so the token must belong to this tenant
+    return await db.users.find_one({'id': payload.get('user_id')}, {'_id': 0, 'id': 1}) is not None
+
+def profile_requested(scope) -> bool:
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    if '1' in query.get('_profile', []):
+        return True
+    return any(name == b'x-profile' and value == b'1' for name, value in scope['headers'])
+
+class ProfilingMiddleware:
+    # Plain ASGI rather than @app.middleware, so unprofiled requests only pay
+    # for a header scan and the profile covers streamed bodies as well
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        requested = profile_requested(scope)
+        sampled = not requested and PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+        if (requested or sampled) and not scope['path'].startswith('/api/profiles'):
+            request = Request(scope)
+            if sampled or await is_admin_token(request):
+                return await self.profile(request, sampled, receive, send)
+        return await self.app(scope, receive, send)
+
+    async def profile(self, request: Request, sampled: bool, receive, send):
+        profile_id = str(uuid.uuid4())
+        status_code = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                message.setdefault('headers', [])
+                message['headers'] = [*message['headers'], (b'x-profile-id', profile_id.encode('ascii'))]
+            await send(message)
+
+        commands: List[Dict[str, Any]] = []
+        token = profiled_commands.set(commands)
+        task_profiler = TaskProfiler(self.app(request.scope, receive, send_with_profile_id))
+        wall_start = time.perf_counter()
+        try:
+            await task_profiler
+        finally:
+            wall_ms = (time.perf_counter() - wall_start) * 1000
+            profiled_commands.reset(token)
+
+            output = io.StringIO()
+            pstats.Stats(task_profiler.profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+
+            profile_doc = {
+                'id': profile_id,
+                'method': request.method,
+                'path': request.url.path,
+                'query': str(request.url.query),
+                'status_code': status_code,
+                'sampled': sampled,
+                'wall_ms': round(wall_ms, 3),
+                # Request task on the event loop only: Motor's executor threads show up in mongo_ms instead
+                'cpu_ms': round(task_profiler.cpu_seconds * 1000, 3),
+                'mongo_ms': round(sum(c['duration_ms'] for c in commands), 3),
+                'mongo_commands': commands,
+                'cpu_profile': output.getvalue(),
+                'created_at': datetime.now(timezone.utc).isoformat()
+            }
+            # Store in the background so the write is not part of the measured request
+            spawn(store_profile(profile_doc))
+
+async def store_profile(profile_doc: dict):
+    try:
+        await db.request_profiles.insert_one(profile_doc)
+    except Exception:
+        logger.exception("Failed to store request profile %s", profile_doc['id'])
+
+@api_router.get("/profiles")
+async def get_profiles(limit: int = 50, user: dict = Depends(get_current_user)):
+    limit = max(1, min(limit, 200))
+    projection = {'_id': 0, 'tenant_id': 0, 'cpu_profile': 0, 'mongo_commands': 0}
+    # Capped collections keep insertion order, so natural reverse order is newest first
+    profiles = await db.request_profiles.find({}, projection).sort('$natural', -1).to_list(limit)
+    return profiles
+
+@api_router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, user: dict = Depends(get_current_user)):
+    profile = await db.request_profiles.find_one({'id': profile_id}, {'_id': 0})
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+# =============== TENANTS ===============
+
+# Tenants live in the global "tenants" collection:
+#   {'id': 'acme', 'name': 'Acme', 'hosts': ['acme.com', 'www.acme.com'],
+#    'site_url': 'https://www.acme.com', 'max_concurrent_requests': 10}
+# site_url defaults to https:// plus the first host. With MULTI_TENANT off
+# every request belongs to the default tenant and SITE_URL applies.
+TENANT_CACHE_SECONDS = float(os.environ.get('TENANT_CACHE_SECONDS', '30'))
+TENANT_MAX_CONCURRENCY = int(os.environ.get('TENANT_MAX_CONCURRENCY', '20'))
+TENANT_QUEUE_TIMEOUT = float(os.environ.get('TENANT_QUEUE_TIMEOUT', '2'))
+# Only honour X-Forwarded-Host when a proxy we control sets it
+TRUST_FORWARDED_HOST = os.environ.get('TRUST_FORWARDED_HOST', 'false').lower() in ('1', 'true', 'yes')
+
+tenant_hosts: Dict[str, dict] = {}
+tenant_hosts_loaded_at = 0.0
+tenant_slots: Dict[str, Tuple[int, asyncio.Semaphore]] = {}
+
+async def resolve_tenant(host: str) -> Optional[dict]:
+    global tenant_hosts, tenant_hosts_loaded_at
+    if time.monotonic() - tenant_hosts_loaded_at > TENANT_CACHE_SECONDS:
+        hosts = {}
+        async for tenant in raw_db.tenants.find({}, {'_id': 0}):
+            for tenant_host in tenant.get('hosts', []):
+                hosts[tenant_host.lower()] = tenant
+        tenant_hosts, tenant_hosts_loaded_at = hosts, time.monotonic()
+    return tenant_hosts.get(host)
+
+def tenant_semaphore(tenant: dict) -> asyncio.Semaphore:
+    limit = tenant.get('max_concurrent_requests') or TENANT_MAX_CONCURRENCY
+    slot = tenant_slots.get(tenant['id'])
+    if slot is None or slot[0] != limit:
+        slot = (limit, asyncio.Semaphore(limit))
+        tenant_slots[tenant['id']] = slot
+    return slot[1]
+
+def tenant_site_url(tenant: dict) -> str:
+    if tenant.get('site_url'):
+        return tenant['site_url'].rstrip('/')
+    return f"https://{tenant['hosts'][0]}"
+
+def request_host(scope) -> str:
+    headers = Headers(scope=scope)
+    host = headers.get('host', '')
+    if TRUST_FORWARDED_HOST and headers.get('x-forwarded-host'):
+        # The last entry is the one added by the proxy in front of us
+        host = headers['x-forwarded-host'].split(',')[-1]
+    return host.strip().split(':')[0].lower()
+
+class TenantMiddleware:
+    # Plain ASGI so the tenant slot is held until the response body has been
+    # sent, which matters for the streamed sitemap and feeds
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        tenant = await resolve_tenant(request_host(scope))
+        if not tenant:
+            return await JSONResponse({'detail': "Unknown site"}, status_code=404)(scope, receive, send)
+        token = current_tenant.set(tenant['id'])
+        site_url_token = current_site_url.set(tenant_site_url(tenant))
+
+        # Cap in-flight requests per tenant so one busy site cannot hold every worker slot
+        semaphore = tenant_semaphore(tenant)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), TENANT_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            current_site_url.reset(site_url_token)
+            current_tenant.reset(token)
+            response = JSONResponse(
+                {'detail': "Too many concurrent requests for this site"},
+                status_code=503,
+                headers={'Retry-After': '1'}
+            )
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            semaphore.release()
+            current_site_url.reset(site_url_token)
+            current_tenant.reset(token)
+
+# =============== ADMISSION CONTROL ===============
+
+# Every request is put in a route class. A class admits up to `limit`
+# concurrent requests, and the worker as a whole admits ADMISSION_MAX_CONCURRENCY.
+# Requests over the limit wait in a bounded queue until a slot frees up. Waiters
+# with a higher priority (lower number) are served first, so admin traffic
+# cannot starve anonymous page views. A request that finds its queue full, or
+# that waits past its class timeout, is rejected straight away with 503 and
+# Retry-After.
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', 'true').lower() in ('1', 'true', 'yes')
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get('ADMISSION_MAX_CONCURRENCY', '100'))
+ADMISSION_EXEMPT_PATHS = {'/api/admission'}
+
+class RouteClass:
+    def __init__(self, name: str, priority: int, limit: int, queue_size: int, timeout: float):
+        prefix = f'ADMISSION_{name.upper()}'
+        self.name = name
+        self.priority = priority
+        self.limit = int(os.environ.get(f'{prefix}_LIMIT', str(limit)))
+        self.queue_size = int(os.environ.get(f'{prefix}_QUEUE', str(queue_size)))
+        self.timeout = float(os.environ.get(f'{prefix}_TIMEOUT', str(timeout)))
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self.queued = 0
+        self.queue_ms_total = 0.0
+        self.queue_ms_max = 0.0
+
+    def metrics(self) -> dict:
+        return {
+            'priority': self.priority,
+            'limit': self.limit,
+            'queue_size': self.queue_size,
+            'timeout_seconds': self.timeout,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'shed_queue_full': self.shed_queue_full,
+            'shed_timeout': self.shed_timeout,
+            'queued': self.queued,
+            'avg_queue_ms': round(self.queue_ms_total / self.queued, 3) if self.queued else 0,
+            'max_queue_ms': round(self.queue_ms_max, 3)
+        }
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int, classes: List[RouteClass]):
+        self.max_concurrency = max_concurrency
+        self.classes = {route_class.name: route_class for route_class in classes}
+        self.in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future, RouteClass]] = []
+        self._sequence = itertools.count()
+
+    def _has_room(self, route_class: RouteClass) -> bool:
+        return route_class.in_flight < route_class.limit and self.in_flight < self.max_concurrency
+
+    def _admit(self, route_class: RouteClass):
+        route_class.in_flight += 1
+        route_class.admitted += 1
+        self.in_flight += 1
+
+    async def acquire(self, route_class: RouteClass) -> bool:
+        # With the worker below its global limit, other classes only wait on their own limits
+        ahead = any(not f.done() and waiter_class is route_class for _, _, f, waiter_class in self._waiters)
+        if self._has_room(route_class) and not ahead:
+            self._admit(route_class)
+            return True
+        if route_class.waiting >= route_class.queue_size:
+            route_class.shed_queue_full += 1
+            return False
+
+        # Waiters are resolved with True when granted a slot, or False by their deadline,
+        # whichever comes first
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (route_class.priority, next(self._sequence), future, route_class))
+        route_class.waiting += 1
+        deadline = loop.call_later(route_class.timeout, self._expire, future)
+        start = time.perf_counter()
+        try:
+            admitted = await future
+        except asyncio.CancelledError:
+            # The client went away while queued; hand back a slot granted in the meantime
+            if future.done() and not future.cancelled() and future.result():
+                self.release(route_class)
+            else:
+                future.cancel()
+            raise
+        finally:
+            deadline.cancel()
+            route_class.waiting -= 1
+            waited = (time.perf_counter() - start) * 1000
+            route_class.queued += 1
+            route_class.queue_ms_total += waited
+            route_class.queue_ms_max = max(route_class.queue_ms_max, waited)
+        if not admitted:
+            route_class.shed_timeout += 1
+        return admitted
+
+    def _expire(self, future: asyncio.Future):
+        if not future.done():
+            future.set_result(False)
+
+    def release(self, route_class: RouteClass):
+        route_class.in_flight -= 1
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        skipped = []
+        while self._waiters and self.in_flight < self.max_concurrency:
+            entry = heapq.heappop(self._waiters)
+            _, _, future, route_class = entry
+            if future.done():
+                continue
+            if not self._has_room(route_class):
+                skipped.append(entry)
+                continue
+            self._admit(route_class)
+            future.set_result(True)
+        for entry in skipped:
+            heapq.heappush(self._waiters, entry)
+
+    def metrics(self) -> dict:
+        return {
+            'enabled': ADMISSION_CONTROL,
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'classes': {name: route_class.metrics() for name, route_class in self.classes.items()}
+        }
+
+admission = AdmissionController(ADMISSION_MAX_CONCURRENCY, [
+    RouteClass('public_read', priority=0, limit=80, queue_size=200, timeout=2.0),
+    RouteClass('public_write', priority=1, limit=20, queue_size=50, timeout=3.0),
+    RouteClass('admin', priority=2, limit=10, queue_size=20, timeout=5.0),
+])
+
+def classify_request(scope) -> RouteClass:
+    # Authenticated calls and the bulk seed are admin work; the rest is split by method
+    if 'authorization' in Headers(scope=scope) or scope['path'] == '/api/seed':
+        return admission.classes['admin']
+    if scope['method'] in ('GET', 'HEAD', 'OPTIONS'):
+        return admission.classes['public_read']
+    return admission.classes['public_write']
+
+class AdmissionMiddleware:
+    # Plain ASGI so a slot is held until the response body has been sent,
+    # which keeps streamed sitemap and feed generation under admission control
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] in ADMISSION_EXEMPT_PATHS:
+            return await self.app(scope, receive, send)
+
+        route_class = classify_request(scope)
+        if not await admission.acquire(route_class):
+            response = JSONResponse(
+                {'detail': "Server is busy, please retry shortly"},
+                status_code=503,
+                headers={'Retry-After': str(max(1, round(route_class.timeout)))}
+            )
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release(route_class)
+
+@api_router.get("/admission")
+async def get_admission_metrics(user: dict = Depends(get_current_user)):
+    return admission.metrics()
+
 # =============== SEED DATA ENDPOINT ===============
 
 @api_router.post("/seed")
@@ -789,9 +1580,259 @@ async def seed_data():
     
     return {"message": "Sample data seeded successfully"}
 
+# =============== SITEMAP & FEED ENDPOINTS ===============
+
+# Sitemaps and feeds are streamed straight from Mongo cursors and cached per
+# worker under a content version. The version only changes when a document is
+# created, deleted, (un)published or gets a new updated_at, so crawlers hitting
+# these routes never trigger a rebuild of unchanged output.
+SITE_URL = os.environ.get('SITE_URL', '').rstrip('/')
+SITEMAP_SHARD_SIZE = 50000
+# Routes the frontend serves. CMS pages and portfolio items have no route of
+# their own unless PAGE_PATH / PORTFOLIO_ITEM_PATH name one, e.g.
+# PORTFOLIO_ITEM_PATH=/portfolio/{id}; until then only these paths are listed.
+SITEMAP_STATIC_PATHS = [
+    path.strip() for path in
+    os.environ.get('SITEMAP_STATIC_PATHS', '/,/about,/services,/portfolio,/contact').split(',')
+    if path.strip()
+]
+PAGE_PATH = os.environ.get('PAGE_PATH', '')
+PORTFOLIO_ITEM_PATH = os.environ.get('PORTFOLIO_ITEM_PATH', '')
+FEED_ITEM_LIMIT = int(os.environ.get('FEED_ITEM_LIMIT', '50'))
+
+feed_cache: Dict[str, Tuple[str, bytes]] = {}
+
+def site_url_for(request: Request) -> str:
+    # Multi-tenant requests always carry their tenant's URL
+    return current_site_url.get() or SITE_URL or str(request.base_url).rstrip('/')
+
+async def content_version(site_url: str) -> str:
+    # Feeds embed the site name, so settings changes invalidate cached output too
+    settings = await db.settings.find_one({}, {'_id': 0, 'site_name': 1})
+    fingerprint = [site_url, settings.get('site_name') if settings else None]
+    for collection in (db.pages, db.portfolio):
+        latest = await collection.find_one({}, {'_id': 0, 'updated_at': 1}, sort=[('updated_at', -1)])
+        fingerprint.extend([
+            await collection.count_documents({}),
+            await collection.count_documents({'is_published': True}),
+            latest['updated_at'] if latest else None
+        ])
+    return hashlib.sha1(json.dumps(fingerprint).encode('utf-8')).hexdigest()[:16]
+
+async def cached_response(
+    request: Request,
+    key: str,
+    version: str,
+    media_type: str,
+    producer: Callable[[], AsyncIterator[str]]
+) -> Response:
+    headers = {'ETag': f'"{version}"', 'Cache-Control': 'public, max-age=300'}
+    if request.headers.get('if-none-match') == headers['ETag']:
+        return Response(status_code=304, headers=headers)
+
+    key = f'{current_tenant.get()}:{key}'
+    cached = feed_cache.get(key)
+    if cached and cached[0] == version:
+        return Response(content=cached[1], media_type=media_type, headers=headers)
+
+    async def body():
+        chunks = []
+        async for chunk in producer():
+            data = chunk.encode('utf-8')
+            chunks.append(data)
+            yield data
+        # Only cache output that was generated completely
+        feed_cache[key] = (version, b''.join(chunks))
+
+    return StreamingResponse(body(), media_type=media_type, headers=headers)
+
+def page_path(slug: str) -> str:
+    if PAGE_PATH:
+        return PAGE_PATH.format(slug=slug)
+    return '/' if slug == 'home' else f'/{slug}'
+
+def portfolio_item_url(site_url: str, item: dict) -> str:
+    # Without an item route, link to the portfolio listing that shows it
+    if PORTFOLIO_ITEM_PATH:
+        return site_url + PORTFOLIO_ITEM_PATH.format(id=item['id'])
+    return f'{site_url}/portfolio'
+
+def sitemap_url(site_url: str, path: str, lastmod: Optional[str]) -> str:
+    entry = f"<url><loc>{escape(site_url + path)}</loc>"
+    if lastmod:
+        entry += f"<lastmod>{escape(lastmod)}</lastmod>"
+    return entry + "</url>\n"
+
+async def static_sitemap_entries(site_url: str) -> List[str]:
+    # Static routes take their lastmod from the CMS page rendered there, if any
+    lastmods = {}
+    if not PAGE_PATH:
+        slugs = ['home' if path == '/' else path.lstrip('/') for path in SITEMAP_STATIC_PATHS]
+        async for page in db.pages.find(
+            {'is_published': True, 'slug': {'$in': slugs}},
+            {'_id': 0, 'slug': 1, 'updated_at': 1}
+        ):
+            lastmods[page_path(page['slug'])] = page['updated_at']
+    return [sitemap_url(site_url, path, lastmods.get(path)) for path in SITEMAP_STATIC_PATHS]
+
+def routed_sources() -> list:
+    sources = []
+    if PAGE_PATH:
+        sources.append((db.pages, lambda doc: page_path(doc['slug'])))
+    if PORTFOLIO_ITEM_PATH:
+        sources.append((db.portfolio, lambda doc: PORTFOLIO_ITEM_PATH.format(id=doc['id'])))
+    return sources
+
+async def sitemap_entries(skip: int, limit: int, site_url: str) -> AsyncIterator[str]:
+    static = await static_sitemap_entries(site_url)
+    for entry in static[skip:skip + limit]:
+        limit -= 1
+        yield entry
+    skip = max(skip - len(static), 0)
+
+    for collection, path_for in routed_sources():
+        if limit <= 0:
+            return
+        total = await collection.count_documents({'is_published': True})
+        if skip >= total:
+            skip -= total
+            continue
+        cursor = collection.find(
+            {'is_published': True},
+            {'_id': 0, 'id': 1, 'slug': 1, 'updated_at': 1}
+        ).sort('id', 1).skip(skip).limit(limit)
+        async for doc in cursor:
+            limit -= 1
+            yield sitemap_url(site_url, path_for(doc), doc['updated_at'])
+        skip = 0
+
+async def sitemap_shard_count() -> int:
+    total = len(SITEMAP_STATIC_PATHS)
+    for collection, _ in routed_sources():
+        total += await collection.count_documents({'is_published': True})
+    return max((total + SITEMAP_SHARD_SIZE - 1) // SITEMAP_SHARD_SIZE, 1)
+
+@app.get("/sitemap.xml")
+async def get_sitemap(request: Request):
+    site_url = site_url_for(request)
+    version = await content_version(site_url)
+    shards = await sitemap_shard_count()
+
+    if shards <= 1:
+        return await sitemap_shard_response(request, 0, site_url, version)
+
+    async def produce():
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        for shard in range(shards):
+            yield f"<sitemap><loc>{escape(site_url)}/sitemap-{shard}.xml</loc></sitemap>\n"
+        yield '</sitemapindex>\n'
+
+    return await cached_response(request, 'sitemap.xml', version, 'application/xml', produce)
+
+async def sitemap_shard_response(request: Request, shard: int, site_url: str, version: str) -> Response:
+    async def produce():
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        async for entry in sitemap_entries(shard * SITEMAP_SHARD_SIZE, SITEMAP_SHARD_SIZE, site_url):
+            yield entry
+        yield '</urlset>\n'
+
+    return await cached_response(request, f'sitemap-{shard}.xml', version, 'application/xml', produce)
+
+@app.get("/sitemap-{shard}.xml")
+async def get_sitemap_shard(request: Request, shard: int):
+    if shard < 0 or shard >= await sitemap_shard_count():
+        # Drop output cached for shards that no longer exist, and never cache a miss
+        feed_cache.pop(f'{current_tenant.get()}:sitemap-{shard}.xml', None)
+        raise HTTPException(status_code=404, detail="Sitemap not found")
+    site_url = site_url_for(request)
+    return await sitemap_shard_response(request, shard, site_url, await content_version(site_url))
+
+def published_portfolio_cursor():
+    return db.portfolio.find({'is_published': True}, {'_id': 0}).sort('created_at', -1).limit(FEED_ITEM_LIMIT)
+
+@app.get("/feed.xml")
+async def get_rss_feed(request: Request):
+    site_url = site_url_for(request)
+    version = await content_version(site_url)
+    settings = await get_settings()
+    site_name = settings['site_name'] if isinstance(settings, dict) else settings.site_name
+
+    async def produce():
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<rss version="2.0"><channel>\n'
+        yield (
+            f"<title>{escape(site_name)} Portfolio</title>"
+            f"<link>{escape(site_url)}/portfolio</link>"
+            f"<description>Latest work from {escape(site_name)}</description>\n"
+        )
+        async for item in published_portfolio_cursor():
+            link = portfolio_item_url(site_url, item)
+            published = format_datetime(datetime.fromisoformat(item['created_at']))
+            yield (
+                f"<item><title>{escape(item['title'])}</title>"
+                f"<link>{escape(link)}</link>"
+                f"<guid isPermaLink=\"false\">{escape(item['id'])}</guid>"
+                f"<category>{escape(item['category'])}</category>"
+                f"<description>{escape(item['description'])}</description>"
+                f"<pubDate>{published}</pubDate></item>\n"
+            )
+        yield '</channel></rss>\n'
+
+    return await cached_response(request, 'feed.xml', version, 'application/rss+xml', produce)
+
+@app.get("/feed.json")
+async def get_json_feed(request: Request):
+    site_url = site_url_for(request)
+    version = await content_version(site_url)
+    settings = await get_settings()
+    site_name = settings['site_name'] if isinstance(settings, dict) else settings.site_name
+
+    async def produce():
+        header = {
+            'version': 'https://jsonfeed.org/version/1.1',
+            'title': f'{site_name} Portfolio',
+            'home_page_url': f'{site_url}/portfolio',
+            'feed_url': f'{site_url}/feed.json'
+        }
+        # Stream the items array one entry at a time rather than building the whole document
+        yield json.dumps(header)[:-1] + ', "items": ['
+        first = True
+        async for item in published_portfolio_cursor():
+            entry = {
+                'id': item['id'],
+                'url': portfolio_item_url(site_url, item),
+                'title': item['title'],
+                'content_text': item['description'],
+                'image': item.get('thumbnail_url'),
+                'tags': [item['category'], *item.get('tools_used', [])],
+                'date_published': item['created_at'],
+                'date_modified': item['updated_at']
+            }
+            yield ('' if first else ', ') + json.dumps(entry)
+            first = False
+        yield ']}'
+
+    return await cached_response(request, 'feed.json', version, 'application/feed+json', produce)
+
+@app.exception_handler(ReadOnlyStorageError)
+async def read_only_storage_error(request: Request, exc: ReadOnlyStorageError):
+    return JSONResponse({'detail': "This replica is read-only"}, status_code=503)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Middleware added later wraps what was added before it, so requests pass
+# through CORS -> tenant limit -> admission -> profiling -> the app. The tenant
+# limit sits outside admission so a site queued on its own limit does not hold
+# global admission slots while it waits.
+app.add_middleware(ProfilingMiddleware)
+if ADMISSION_CONTROL:
+    app.add_middleware(AdmissionMiddleware)
+if MULTI_TENANT:
+    app.add_middleware(TenantMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -800,6 +1841,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def backfill_tenant_ids():
+    if STORAGE_READ_ONLY:
+        return
+    # Documents written before multi-tenancy belong to the default tenant
+    # (request_profiles is capped, so its documents cannot grow and are left as they are)
+    for name in TENANT_COLLECTIONS - {'request_profiles'}:
+        await raw_db[name].update_many({'tenant_id': {'$exists': False}}, {'$set': {'tenant_id': DEFAULT_TENANT_ID}})
+    await raw_db.tenants.create_index('hosts', unique=True)
+
+@app.on_event("startup")
+async def create_tenant_indexes():
+    # TenantCollection puts tenant_id in front of every key. Unique indexes back
+    # the lookups handlers treat as unique within a site.
+    for name in TENANT_COLLECTIONS - {'analytics_rollups', 'request_profiles'}:
+        await getattr(db, name).create_index('id', unique=True)
+    await db.users.create_index('email', unique=True)
+    await db.leads.create_index('email', unique=True)
+    await db.pages.create_index('slug', unique=True)
+    await db.content.create_index('key', unique=True)
+    for collection in (db.navigation, db.social_links):
+        await collection.create_index('display_order')
+    for collection in (db.portfolio, db.messages, db.leads):
+        await collection.create_index([('created_at', -1)])
+
+@app.on_event("startup")
+async def start_analytics():
+    await db.analytics_rollups.create_index(
+        [('kind', 1), ('item_id', 1), ('granularity', 1), ('bucket', 1)], unique=True
+    )
+    await db.analytics_rollups.create_index([('granularity', 1), ('bucket', 1)])
+    view_aggregator.start()
+
+@app.on_event("startup")
+async def create_feed_indexes():
+    for collection in (db.pages, db.portfolio):
+        await collection.create_index([('updated_at', -1)])
+        await collection.create_index([('is_published', 1), ('id', 1)])
+    await db.portfolio.create_index([('is_published', 1), ('created_at', -1)])
+
+@app.on_event("startup")
+async def create_profile_collection():
+    try:
+        await db.create_collection(
+            'request_profiles', capped=True, size=PROFILE_COLLECTION_BYTES, max=PROFILE_COLLECTION_MAX_DOCS
+        )
+    except CollectionInvalid:
+        pass
+    await db.request_profiles.create_index('id')
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await view_aggregator.stop()
     client.close()
@@ -0,0 +1,624 @@
+"""Embedded SQLite storage with the same collection API the handlers use on Motor.
+
+Each collection is a table of JSON documents in a single WAL-mode SQLite file.
+Only the subset of the Motor API used by server.py is implemented:
+
+    find / find_one / count_documents / insert_one / insert_many
+    update_one / update_many / delete_one / bulk_write (UpdateOne)
+    aggregate ($match, $group, $sort, $limit, $project) / create_index
+
+Filters support equality plus $exists, $in, $ne, $gt, $gte, $lt and $lte on
+top-level fields. Equality on scalar values is pushed down to SQL (and can use
+indexes made by create_index); everything else is evaluated in Python, which
+is fine for the document counts a single site holds. As in Mongo, equality
+also matches elements of array fields. Each collection records which fields
+have held arrays, and only those pay for the json_each() lookup.
+
+Datetimes are stored as UTC. Naive values, which is what Motor returns unless
+tz_aware is set, are taken to be UTC already.
+"""
+import asyncio
+import base64
+import json
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+
+class ReadOnlyStorageError(Exception):
+    pass
+
+
+class InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class UpdateResult:
+    def __init__(self, matched_count: int, modified_count: int):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+
+
+class DeleteResult:
+    def __init__(self, deleted_count: int):
+        self.deleted_count = deleted_count
+
+
+# =============== JSON ENCODING ===============
+
+def _utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+# Datetimes and binary values have no JSON type, so they are stored tagged.
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'$date': _utc(value).isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {'$binary': base64.b64encode(bytes(value)).decode('ascii')}
+    raise TypeError(f"Cannot store {type(value).__name__} in SQLite storage")
+
+
+def _decode(obj: dict):
+    if len(obj) == 1:
+        if '$date' in obj:
+            return _utc(datetime.fromisoformat(obj['$date']))
+        if '$binary' in obj:
+            return base64.b64decode(obj['$binary'])
+    return obj
+
+
+def dumps(document: dict) -> str:
+    return json.dumps(document, default=_encode, separators=(',', ':'))
+
+
+def loads(data: str) -> dict:
+    return json.loads(data, object_hook=_decode)
+
+
+# =============== QUERY EVALUATION ===============
+
+_MISSING = object()
+
+
+def _get(document: dict, path: str):
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _compare(value, op: str, operand) -> bool:
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if op == '$gt':
+            return value > operand
+        if op == '$gte':
+            return value >= operand
+        if op == '$lt':
+            return value < operand
+        return value <= operand
+    except TypeError:
+        return False
+
+
+def _equals(value, expected) -> bool:
+    if expected is None:
+        return value is _MISSING or value is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value is not _MISSING and value == expected
+
+
+def matches(document: dict, query: dict) -> bool:
+    for field, condition in query.items():
+        value = _get(document, field)
+        if isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition):
+            for op, operand in condition.items():
+                if op == '$exists':
+                    if (value is not _MISSING) != bool(operand):
+                        return False
+                elif op == '$in':
+                    if not any(_equals(value, candidate) for candidate in operand):
+                        return False
+                elif op == '$ne':
+                    if _equals(value, operand):
+                        return False
+                elif op in ('$gt', '$gte', '$lt', '$lte'):
+                    if not _compare(value, op, operand):
+                        return False
+                else:
+                    raise NotImplementedError(f"Query operator {op} is not supported by SQLite storage")
+        elif not _equals(value, condition):
+            return False
+    return True
+
+
+def _sort_documents(documents: List[dict], sort: List[Tuple[str, int]]) -> List[dict]:
+    # Stable sorts applied from the last key to the first give a multi-key sort
+    for field, direction in reversed(sort):
+        def key(document, field=field):
+            value = _get(document, field)
+            if value is _MISSING or value is None:
+                return (0, '')
+            return (1, value)
+        documents.sort(key=key, reverse=direction < 0)
+    return documents
+
+
+def _project(document: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return document
+    fields = {k: v for k, v in projection.items() if k != '_id'}
+    if any(fields.values()):
+        return {k: document[k] for k, v in fields.items() if v and k in document}
+    return {k: v for k, v in document.items() if fields.get(k, 1)}
+
+
+def _apply_update(document: dict, update: dict, inserting: bool = False) -> dict:
+    for op, fields in update.items():
+        if op == '$set':
+            document.update(fields)
+        elif op == '$setOnInsert':
+            if inserting:
+                document.update(fields)
+        elif op == '$inc':
+            for field, amount in fields.items():
+                document[field] = document.get(field, 0) + amount
+        elif op == '$unset':
+            for field in fields:
+                document.pop(field, None)
+        else:
+            raise NotImplementedError(f"Update operator {op} is not supported by SQLite storage")
+    return document
+
+
+def _normalize_sort(key_or_list, direction=None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    return list(key_or_list)
+
+
+def _normalize_keys(keys) -> List[Tuple[str, int]]:
+    if isinstance(keys, str):
+        return [(keys, 1)]
+    return list(keys)
+
+
+# =============== AGGREGATION ===============
+
+def _evaluate(expression, document: dict):
+    if isinstance(expression, str) and expression.startswith('$'):
+        value = _get(document, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, dict):
+        if '$cond' in expression:
+            condition, then, otherwise = expression['$cond']
+            return _evaluate(then if _evaluate(condition, document) not in (None, False, 0) else otherwise, document)
+        if '$ifNull' in expression:
+            value, replacement = expression['$ifNull']
+            value = _evaluate(value, document)
+            return _evaluate(replacement, document) if value is None else value
+        return {key: _evaluate(value, document) for key, value in expression.items()}
+    return expression
+
+
+def _group(documents: List[dict], spec: dict) -> List[dict]:
+    groups: Dict[str, dict] = {}
+    for document in documents:
+        group_id = _evaluate(spec['_id'], document)
+        key = dumps({'k': group_id})
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {'_id': group_id}
+        for field, accumulator in spec.items():
+            if field == '_id':
+                continue
+            (op, expression), = accumulator.items()
+            value = _evaluate(expression, document)
+            if op == '$sum':
+                number = value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+                group[field] = group.get(field, 0) + number
+            elif op in ('$max', '$min'):
+                current = group.get(field)
+                if value is not None and (current is None or (value > current if op == '$max' else value < current)):
+                    group[field] = value
+                group.setdefault(field, None)
+            else:
+                raise NotImplementedError(f"Accumulator {op} is not supported by SQLite storage")
+    return list(groups.values())
+
+
+def _project_stage(documents: List[dict], spec: dict) -> List[dict]:
+    include_id = spec.get('_id', 1)
+    fields = {k: v for k, v in spec.items() if k != '_id'}
+    if not any(v not in (0, False) for v in fields.values()):
+        excluded = set(fields) | (set() if include_id else {'_id'})
+        return [{k: v for k, v in document.items() if k not in excluded} for document in documents]
+
+    projected = []
+    for document in documents:
+        result = {'_id': document['_id']} if include_id and '_id' in document else {}
+        for field, expression in fields.items():
+            if expression in (1, True):
+                value = _get(document, field)
+                if value is not _MISSING:
+                    result[field] = value
+            else:
+                result[field] = _evaluate(expression, document)
+        projected.append(result)
+    return projected
+
+
+def run_pipeline(documents: List[dict], pipeline: List[dict]) -> List[dict]:
+    for stage in pipeline:
+        (op, spec), = stage.items()
+        if op == '$match':
+            documents = [document for document in documents if matches(document, spec)]
+        elif op == '$group':
+            documents = _group(documents, spec)
+        elif op == '$sort':
+            documents = _sort_documents(documents, list(spec.items()))
+        elif op == '$limit':
+            documents = documents[:spec]
+        elif op == '$project':
+            documents = _project_stage(documents, spec)
+        else:
+            raise NotImplementedError(f"Pipeline stage {op} is not supported by SQLite storage")
+    return documents
+
+
+# =============== DATABASE ===============
+
+def _field_sql(field: str) -> str:
+    return f"json_extract(doc, '$.\"{field}\"')"
+
+
+def _array_fields(documents: List[dict]) -> set:
+    return {field for document in documents for field, value in document.items() if isinstance(value, list)}
+
+
+def _update_one_arguments(operation) -> Tuple[dict, dict, bool]:
+    # pymongo has no public accessors for an UpdateOne's arguments. The private
+    # attributes are stable across the pinned 4.x line; fail loudly if they move.
+    if not isinstance(operation, UpdateOne):
+        raise NotImplementedError(f"{type(operation).__name__} is not supported by SQLite bulk_write")
+    try:
+        return operation._filter, operation._doc, operation._upsert
+    except AttributeError as error:
+        raise NotImplementedError(f"Unsupported pymongo UpdateOne layout: {error}") from error
+
+
+def _table(name: str) -> str:
+    if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', name):
+        raise ValueError(f"Invalid collection name {name!r}")
+    return f'"{name}"'
+
+
+class SQLiteDatabase:
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        # One thread owns the connection; every operation is queued onto it
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-storage')
+        self._tables: set = set()
+        self._capped: Dict[str, int] = {}
+        # Fields that have held an array per collection; None if the file predates tracking
+        self._array_fields: Optional[Dict[str, set]] = {}
+        self._connection = self._executor.submit(self._connect).result()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+        else:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS _collections (name TEXT PRIMARY KEY, max_docs INTEGER)')
+            if not connection.execute("SELECT 1 FROM sqlite_master WHERE name = '_array_fields'").fetchone():
+                self._create_array_fields(connection)
+        connection.execute('PRAGMA busy_timeout=5000')
+        tables = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        self._tables = {name for (name,) in tables}
+        if '_collections' in self._tables:
+            for name, max_docs in connection.execute('SELECT name, max_docs FROM _collections'):
+                if max_docs:
+                    self._capped[name] = max_docs
+        if '_array_fields' in self._tables:
+            for name, field in connection.execute('SELECT collection, field FROM _array_fields'):
+                self._array_fields.setdefault(name, set()).add(field)
+        elif '_collections' in self._tables:
+            # Read-only copy of a file written before array fields were tracked
+            self._array_fields = None
+        return connection
+
+    @staticmethod
+    def _create_array_fields(connection: sqlite3.Connection):
+        connection.execute('CREATE TABLE _array_fields (collection TEXT, field TEXT, PRIMARY KEY (collection, field))')
+        # Files from before array fields were tracked get one full scan
+        for (name,) in connection.execute('SELECT name FROM _collections').fetchall():
+            for (doc,) in connection.execute(f'SELECT doc FROM {_table(name)}'):
+                for field in _array_fields([json.loads(doc)]):
+                    connection.execute('INSERT OR IGNORE INTO _array_fields (collection, field) VALUES (?, ?)', (name, field))
+        connection.commit()
+
+    def may_hold_array(self, name: str, field: str) -> bool:
+        return self._array_fields is None or field in self._array_fields.get(name, ())
+
+    def record_array_fields(self, name: str, documents: List[dict]):
+        known = self._array_fields.setdefault(name, set())
+        for field in _array_fields(documents) - known:
+            self._connection.execute('INSERT OR IGNORE INTO _array_fields (collection, field) VALUES (?, ?)', (name, field))
+            known.add(field)
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def ensure_table(self, name: str) -> bool:
+        if name in self._tables:
+            return True
+        if self.read_only:
+            return False
+        self._connection.execute(f'CREATE TABLE IF NOT EXISTS {_table(name)} (id INTEGER PRIMARY KEY, doc TEXT NOT NULL)')
+        self._connection.execute('INSERT OR IGNORE INTO _collections (name) VALUES (?)', (name,))
+        self._connection.commit()
+        self._tables.add(name)
+        return True
+
+    def check_writable(self):
+        if self.read_only:
+            raise ReadOnlyStorageError(f"{self.path} is opened read-only")
+
+    def __getitem__(self, name: str) -> 'SQLiteCollection':
+        return SQLiteCollection(self, name)
+
+    def __getattr__(self, name: str) -> 'SQLiteCollection':
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return SQLiteCollection(self, name)
+
+    async def create_collection(self, name: str, capped: bool = False, size: Optional[int] = None, max: Optional[int] = None):
+        # Capped collections keep at most `max` documents; `size` has no SQLite equivalent
+        def create():
+            if self.read_only:
+                return
+            self.ensure_table(name)
+            if capped and max:
+                self._connection.execute('UPDATE _collections SET max_docs = ? WHERE name = ?', (max, name))
+                self._connection.commit()
+                self._capped[name] = max
+        await self.run(create)
+        return self[name]
+
+    def close(self):
+        def close():
+            self._connection.close()
+        self._executor.submit(close).result()
+        self._executor.shutdown()
+
+
+class SQLiteCursor:
+    def __init__(self, collection: 'SQLiteCollection', query: Optional[dict], projection: Optional[dict]):
+        self.collection = collection
+        self.query = query or {}
+        self.projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None) -> 'SQLiteCursor':
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count: int) -> 'SQLiteCursor':
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> 'SQLiteCursor':
+        self._limit = count
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        limit = self._limit
+        if length:
+            limit = min(limit, length) if limit else length
+        rows = await self.collection.database.run(
+            self.collection.select_sync, self.query, self._sort, self._skip, limit
+        )
+        return [_project(document, self.projection) for _, document in rows]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in await self.to_list():
+            yield document
+
+
+class SQLiteAggregation:
+    def __init__(self, collection: 'SQLiteCollection', pipeline: List[dict]):
+        self.collection = collection
+        self.pipeline = pipeline
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        pipeline = list(self.pipeline)
+        # A leading $match narrows the rows read from SQLite
+        query = pipeline.pop(0)['$match'] if pipeline and '$match' in pipeline[0] else {}
+        rows = await self.collection.database.run(self.collection.select_sync, query, [], 0, 0)
+        documents = run_pipeline([document for _, document in rows], pipeline)
+        return documents[:length] if length else documents
+
+
+class SQLiteCollection:
+    def __init__(self, database: SQLiteDatabase, name: str):
+        self.database = database
+        self.name = name
+        self.table = _table(name)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        return self.database._connection
+
+    # ----- sync helpers, run on the storage thread -----
+
+    def select_sync(self, query: dict, sort: List[Tuple[str, int]], skip: int, limit: int) -> List[Tuple[int, dict]]:
+        if not self.database.ensure_table(self.name):
+            return []
+        clauses, params, residual = [], [], {}
+        for field, condition in query.items():
+            if isinstance(condition, (str, int, float)) and '.' not in field:
+                value = int(condition) if isinstance(condition, bool) else condition
+                if self.database.may_hold_array(self.name, field):
+                    clauses.append(
+                        f'({_field_sql(field)} = ? OR EXISTS '
+                        f"(SELECT 1 FROM json_each(doc, '$.\"{field}\"') WHERE json_each.value = ?))"
+                    )
+                    params.extend([value, value])
+                else:
+                    clauses.append(f'{_field_sql(field)} = ?')
+                    params.append(value)
+            else:
+                residual[field] = condition
+        sql = f'SELECT id, doc FROM {self.table}'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+
+        natural = [direction for field, direction in sort if field == '$natural']
+        pushdown = not residual and (not sort or natural)
+        if pushdown:
+            sql += f" ORDER BY id {'DESC' if natural and natural[0] < 0 else 'ASC'}"
+            if limit or skip:
+                sql += ' LIMIT ? OFFSET ?'
+                params.extend([limit or -1, skip])
+
+        rows = [(row_id, loads(doc)) for row_id, doc in self.connection.execute(sql, params)]
+        rows = [(row_id, document) for row_id, document in rows if matches(document, query)]
+        if pushdown:
+            return rows
+
+        if natural:
+            rows.sort(key=lambda row: row[0], reverse=natural[0] < 0)
+        elif sort:
+            ordered = _sort_documents([document for _, document in rows], sort)
+            ids = {id(document): row_id for row_id, document in rows}
+            rows = [(ids[id(document)], document) for document in ordered]
+        rows = rows[skip:]
+        return rows[:limit] if limit else rows
+
+    def insert_sync(self, documents: List[dict]):
+        self.database.check_writable()
+        self.database.ensure_table(self.name)
+        self.database.record_array_fields(self.name, documents)
+        self.connection.executemany(
+            f'INSERT INTO {self.table} (doc) VALUES (?)', [(dumps(document),) for document in documents]
+        )
+        max_docs = self.database._capped.get(self.name)
+        if max_docs:
+            self.connection.execute(
+                f'DELETE FROM {self.table} WHERE id <= '
+                f'(SELECT id FROM {self.table} ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                (max_docs,)
+            )
+        self.connection.commit()
+
+    def update_sync(self, query: dict, update: dict, upsert: bool, many: bool, commit: bool = True) -> UpdateResult:
+        self.database.check_writable()
+        rows = self.select_sync(query, [], 0, 0 if many else 1)
+        for row_id, document in rows:
+            document = _apply_update(document, update)
+            self.database.record_array_fields(self.name, [document])
+            self.connection.execute(f'UPDATE {self.table} SET doc = ? WHERE id = ?', (dumps(document), row_id))
+        if not rows and upsert:
+            base = {
+                field: value for field, value in query.items()
+                if not (isinstance(value, dict) and any(key.startswith('$') for key in value))
+            }
+            document = _apply_update(base, update, inserting=True)
+            self.database.record_array_fields(self.name, [document])
+            self.connection.execute(f'INSERT INTO {self.table} (doc) VALUES (?)', (dumps(document),))
+        if commit:
+            self.connection.commit()
+        return UpdateResult(len(rows), len(rows))
+
+    def delete_sync(self, query: dict) -> DeleteResult:
+        self.database.check_writable()
+        rows = self.select_sync(query, [], 0, 1)
+        for row_id, _ in rows:
+            self.connection.execute(f'DELETE FROM {self.table} WHERE id = ?', (row_id,))
+        self.connection.commit()
+        return DeleteResult(len(rows))
+
+    def bulk_write_sync(self, operations) -> int:
+        self.database.check_writable()
+        try:
+            for operation in operations:
+                self.update_sync(*_update_one_arguments(operation), many=False, commit=False)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        return len(operations)
+
+    def create_index_sync(self, keys: List[Tuple[str, int]], unique: bool) -> str:
+        name = f"{self.name}_{'_'.join(field for field, _ in keys)}"
+        if self.database.read_only:
+            return name
+        self.database.ensure_table(self.name)
+        columns = ', '.join(f"{_field_sql(field)} {'DESC' if direction == -1 else 'ASC'}" for field, direction in keys)
+        self.connection.execute(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS \"{name}\" ON {self.table} ({columns})"
+        )
+        self.connection.commit()
+        return name
+
+    # ----- Motor-compatible API -----
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> SQLiteCursor:
+        return SQLiteCursor(self, query, projection)
+
+    async def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None, sort=None) -> Optional[dict]:
+        cursor = self.find(query, projection)
+        if sort:
+            cursor.sort(sort)
+        documents = await cursor.limit(1).to_list(1)
+        return documents[0] if documents else None
+
+    async def count_documents(self, query: dict) -> int:
+        rows = await self.database.run(self.select_sync, query, [], 0, 0)
+        return len(rows)
+
+    async def insert_one(self, document: dict) -> InsertOneResult:
+        await self.database.run(self.insert_sync, [document])
+        return InsertOneResult(document.get('id'))
+
+    async def insert_many(self, documents: List[dict]):
+        await self.database.run(self.insert_sync, documents)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        return await self.database.run(self.update_sync, query, update, upsert, False)
+
+    async def update_many(self, query: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        return await self.database.run(self.update_sync, query, update, upsert, True)
+
+    async def delete_one(self, query: dict) -> DeleteResult:
+        return await self.database.run(self.delete_sync, query)
+
+    async def bulk_write(self, operations, ordered: bool = True) -> int:
+        return await self.database.run(self.bulk_write_sync, operations)
+
+    def aggregate(self, pipeline: List[dict]) -> SQLiteAggregation:
+        return SQLiteAggregation(self, pipeline)
+
+    async def create_index(self, keys, unique: bool = False, **kwargs) -> str:
+        return await self.database.run(self.create_index_sync, _normalize_keys(keys), unique)
@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+# server.py reads its configuration at import, so the API tests' settings are
+# fixed here, before any test module imports it
+os.environ.update({
+    'STORAGE_BACKEND': 'sqlite',
+    'SQLITE_PATH': os.path.join(tempfile.mkdtemp(prefix='ima-tests-'), 'api.sqlite3'),
+    'MULTI_TENANT': 'true',
+    'TENANT_CACHE_SECONDS': '0',
+    'SECTIONS_COMPRESSION': 'true',
+    'SECTIONS_COMPRESS_THRESHOLD': '256',
+    'JWT_SECRET': 'test-secret-key-that-is-long-enough-for-hs256',
+})
+os.environ.pop('SITE_URL', None)
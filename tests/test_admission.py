@@ -0,0 +1,144 @@
+import asyncio
+
+from server import AdmissionController, RouteClass
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def controller(max_concurrency=1, **overrides):
+    settings = {
+        'reads': dict(priority=0, limit=10, queue_size=10, timeout=5.0),
+        'writes': dict(priority=1, limit=10, queue_size=10, timeout=5.0),
+        'admin': dict(priority=2, limit=10, queue_size=10, timeout=5.0),
+    }
+    for name, values in overrides.items():
+        settings[name].update(values)
+    classes = [RouteClass(f'test_{name}', **values) for name, values in settings.items()]
+    admission = AdmissionController(max_concurrency, classes)
+    return admission, {name: admission.classes[f'test_{name}'] for name in settings}
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_admits_immediately_with_room():
+    async def scenario():
+        admission, classes = controller(max_concurrency=2)
+        assert await admission.acquire(classes['reads'])
+        assert await admission.acquire(classes['admin'])
+        assert admission.in_flight == 2
+        assert classes['reads'].queued == 0
+    run(scenario())
+
+
+def test_higher_priority_class_goes_first_at_the_global_cap():
+    async def scenario():
+        admission, classes = controller(max_concurrency=1)
+        assert await admission.acquire(classes['admin'])
+        order = []
+
+        async def request(name):
+            assert await admission.acquire(classes[name])
+            order.append(name)
+            admission.release(classes[name])
+
+        # Queued lowest priority first, so arrival order alone would be wrong
+        tasks = [asyncio.ensure_future(request(name)) for name in ('admin', 'writes', 'reads')]
+        await settle()
+        assert order == []
+        admission.release(classes['admin'])
+        await asyncio.gather(*tasks)
+        assert order == ['reads', 'writes', 'admin']
+        assert admission.in_flight == 0
+    run(scenario())
+
+
+def test_full_class_does_not_block_other_classes():
+    async def scenario():
+        admission, classes = controller(max_concurrency=2, reads={'limit': 1})
+        assert await admission.acquire(classes['reads'])
+        waiter = asyncio.ensure_future(admission.acquire(classes['reads']))
+        await settle()
+        assert await admission.acquire(classes['writes'])
+        admission.release(classes['reads'])
+        assert await waiter
+        assert classes['reads'].in_flight == 1
+    run(scenario())
+
+
+def test_waiter_past_its_deadline_is_shed():
+    async def scenario():
+        admission, classes = controller(max_concurrency=1, reads={'timeout': 0.01})
+        assert await admission.acquire(classes['admin'])
+        assert not await admission.acquire(classes['reads'])
+        assert classes['reads'].shed_timeout == 1
+        assert classes['reads'].waiting == 0
+        # The expired waiter is skipped, not granted a slot nobody will release
+        admission.release(classes['admin'])
+        assert admission.in_flight == 0
+    run(scenario())
+
+
+def test_full_queue_sheds_without_waiting():
+    async def scenario():
+        admission, classes = controller(max_concurrency=1, reads={'queue_size': 1})
+        assert await admission.acquire(classes['admin'])
+        waiter = asyncio.ensure_future(admission.acquire(classes['reads']))
+        await settle()
+        assert not await admission.acquire(classes['reads'])
+        assert classes['reads'].shed_queue_full == 1
+        admission.release(classes['admin'])
+        assert await waiter
+    run(scenario())
+
+
+def test_grant_racing_the_timeout_keeps_the_slot():
+    async def scenario():
+        admission, classes = controller(max_concurrency=1)
+        assert await admission.acquire(classes['admin'])
+        waiter = asyncio.ensure_future(admission.acquire(classes['reads']))
+        await settle()
+        future = admission._waiters[0][2]
+        # The slot is handed over in the same tick the deadline fires
+        admission.release(classes['admin'])
+        admission._expire(future)
+        assert await waiter
+        assert classes['reads'].shed_timeout == 0
+        assert admission.in_flight == 1
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        admission, classes = controller(max_concurrency=1)
+        assert await admission.acquire(classes['admin'])
+        waiter = asyncio.ensure_future(admission.acquire(classes['reads']))
+        await settle()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert classes['reads'].waiting == 0
+        admission.release(classes['admin'])
+        assert admission.in_flight == 0
+        assert classes['reads'].admitted == 0
+    run(scenario())
+
+
+def test_waiter_cancelled_after_its_grant_hands_the_slot_back():
+    async def scenario():
+        admission, classes = controller(max_concurrency=1)
+        assert await admission.acquire(classes['admin'])
+        waiter = asyncio.ensure_future(admission.acquire(classes['reads']))
+        next_in_line = asyncio.ensure_future(admission.acquire(classes['writes']))
+        await settle()
+        # Granted, then cancelled before the waiter got to run
+        admission.release(classes['admin'])
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert classes['reads'].in_flight == 0
+        assert await next_in_line
+        assert admission.in_flight == 1
+    run(scenario())
@@ -0,0 +1,153 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+SECTIONS = [{'type': 'text', 'body': 'Lorem ipsum dolor sit amet. ' * 40}]
+TOKENS = {}
+
+
+@pytest.fixture(scope='module')
+def client():
+    with TestClient(server.app) as client:
+        client.portal.call(server.raw_db.tenants.insert_many, [
+            {'id': 'alpha', 'name': 'Alpha', 'hosts': ['alpha.test']},
+            {'id': 'beta', 'name': 'Beta', 'hosts': ['beta.test'], 'site_url': 'https://www.beta.test'},
+        ])
+        yield client
+
+
+def site(host):
+    return {'Host': host}
+
+
+def admin(client, host):
+    # Registering once per site keeps bcrypt out of every test
+    if host not in TOKENS:
+        response = client.post(
+            '/api/auth/register', headers=site(host), json={'email': 'admin@example.com', 'password': 'secret', 'name': 'Admin'}
+        )
+        TOKENS[host] = response.json()['access_token']
+    return {**site(host), 'Authorization': f"Bearer {TOKENS[host]}"}
+
+
+def create_page(client, host, slug, **fields):
+    page = {'title': slug.title(), 'slug': slug, 'sections': SECTIONS, **fields}
+    response = client.post('/api/pages', headers=admin(client, host), json=page)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+# =============== TENANTS ===============
+
+def test_unknown_host_is_rejected(client):
+    response = client.get('/api/pages', headers=site('unknown.test'))
+    assert response.status_code == 404
+    assert response.json()['detail'] == "Unknown site"
+
+
+def test_tenants_see_only_their_own_content(client):
+    create_page(client, 'alpha.test', 'only-alpha')
+    assert client.get('/api/pages/only-alpha', headers=site('alpha.test')).status_code == 200
+    assert client.get('/api/pages/only-alpha', headers=site('beta.test')).status_code == 404
+    slugs = [page['slug'] for page in client.get('/api/pages', headers=site('beta.test')).json()]
+    assert 'only-alpha' not in slugs
+
+
+def test_tokens_do_not_carry_across_tenants(client):
+    headers = admin(client, 'alpha.test')
+    assert client.get('/api/auth/me', headers=headers).status_code == 200
+    assert client.get('/api/auth/me', headers={**headers, 'Host': 'beta.test'}).status_code == 401
+
+
+def test_forwarded_host_is_ignored_unless_trusted(client):
+    response = client.get('/api/pages', headers={'Host': 'unknown.test', 'X-Forwarded-Host': 'alpha.test'})
+    assert response.status_code == 404
+
+
+# =============== SECTIONS ===============
+
+def test_large_sections_are_stored_compressed_and_round_trip(client):
+    page = create_page(client, 'alpha.test', 'compressed')
+    stored = client.portal.call(server.raw_db.pages.find_one, {'id': page['id']})
+    assert stored['sections'] is None
+    assert stored['sections_zlib']
+
+    response = client.get('/api/pages/compressed', headers=site('alpha.test'))
+    assert response.status_code == 200
+    assert response.json()['sections'] == SECTIONS
+    assert response.headers['etag']
+
+
+def test_unchanged_page_answers_304(client):
+    create_page(client, 'alpha.test', 'cached')
+    etag = client.get('/api/pages/cached', headers=site('alpha.test')).headers['etag']
+    response = client.get('/api/pages/cached', headers={**site('alpha.test'), 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+
+
+def test_editing_sections_changes_the_etag(client):
+    page = create_page(client, 'alpha.test', 'edited')
+    etag = client.get('/api/pages/edited', headers=site('alpha.test')).headers['etag']
+    client.put(f"/api/pages/{page['id']}", headers=admin(client, 'alpha.test'), json={'sections': [{'type': 'hero'}]})
+    response = client.get('/api/pages/edited', headers={**site('alpha.test'), 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json()['sections'] == [{'type': 'hero'}]
+
+
+# =============== ANALYTICS ===============
+
+def test_page_views_are_flushed_into_rollups(client):
+    page = create_page(client, 'alpha.test', 'viewed')
+    for _ in range(3):
+        client.get('/api/pages/viewed', headers=site('alpha.test'))
+    client.portal.call(server.view_aggregator.flush)
+
+    for granularity in ('hour', 'day'):
+        response = client.get(
+            '/api/analytics/views',
+            headers=admin(client, 'alpha.test'),
+            params={'kind': 'page', 'item_id': page['id'], 'granularity': granularity}
+        )
+        assert response.status_code == 200
+        body = response.json()
+        assert {'kind': 'page', 'item_id': page['id'], 'views': 3} in body['top']
+        assert sum(point['views'] for point in body['series']) == 3
+
+    other = client.get('/api/analytics/views', headers=admin(client, 'beta.test'), params={'kind': 'page'})
+    assert all(entry['item_id'] != page['id'] for entry in other.json()['top'])
+
+
+# =============== SITEMAP & FEEDS ===============
+
+def test_sitemap_lists_served_routes_on_the_tenant_site(client):
+    create_page(client, 'beta.test', 'about')
+    response = client.get('/sitemap.xml', headers=site('beta.test'))
+    assert response.status_code == 200
+    assert '<url><loc>https://www.beta.test/</loc></url>' in response.text
+    assert '<loc>https://www.beta.test/about</loc><lastmod>' in response.text
+    assert 'alpha.test' not in response.text
+
+    cached = client.get('/sitemap.xml', headers={**site('beta.test'), 'If-None-Match': response.headers['etag']})
+    assert cached.status_code == 304
+
+
+def test_feeds_list_published_portfolio_items(client):
+    headers = admin(client, 'alpha.test')
+    item = {'title': 'Launch video', 'category': 'video', 'description': 'A launch', 'tools_used': ['Premiere']}
+    assert client.post('/api/portfolio', headers=headers, json=item).status_code == 200
+    assert client.post('/api/portfolio', headers=headers, json={**item, 'title': 'Draft', 'is_published': False}).status_code == 200
+
+    feed = client.get('/feed.json', headers=site('alpha.test')).json()
+    assert feed['home_page_url'] == 'https://alpha.test/portfolio'
+    assert [entry['title'] for entry in feed['items']] == ['Launch video']
+    assert feed['items'][0]['url'] == 'https://alpha.test/portfolio'
+    assert feed['items'][0]['tags'] == ['video', 'Premiere']
+
+    rss = client.get('/feed.xml', headers=site('alpha.test'))
+    assert rss.status_code == 200
+    assert '<title>Launch video</title>' in rss.text
+    assert 'Draft' not in rss.text
+
+    assert client.get('/feed.json', headers=site('beta.test')).json()['items'] == []
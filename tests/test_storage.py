@@ -0,0 +1,280 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo import InsertOne, UpdateOne
+
+from storage import ReadOnlyStorageError, SQLiteDatabase, matches, run_pipeline
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = SQLiteDatabase(str(tmp_path / 'test.sqlite3'))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def pages(database):
+    documents = [
+        {'id': 'a', 'slug': 'home', 'is_published': True, 'display_order': 2, 'updated_at': '2025-01-02', 'tags': ['x']},
+        {'id': 'b', 'slug': 'about', 'is_published': False, 'display_order': 1, 'updated_at': '2025-01-03', 'tags': ['y']},
+        {'id': 'c', 'slug': 'work', 'is_published': True, 'display_order': 1, 'updated_at': '2025-01-01'},
+    ]
+    run(database.pages.insert_many(documents))
+    return database.pages
+
+
+# =============== FILTERS ===============
+
+def test_matches_operators():
+    document = {'a': 1, 'b': None, 'tags': ['x', 'y']}
+    assert matches(document, {'a': 1})
+    assert matches(document, {'b': None})
+    assert matches(document, {'missing': None})
+    assert matches(document, {'a': {'$exists': True}, 'missing': {'$exists': False}})
+    assert matches(document, {'a': {'$in': [0, 1]}})
+    assert matches(document, {'a': {'$ne': 2}})
+    assert matches(document, {'a': {'$gte': 1, '$lt': 2}})
+    assert not matches(document, {'a': {'$gt': 1}})
+    assert not matches(document, {'missing': {'$gte': 0}})
+    assert matches(document, {'tags': 'x'})
+
+
+def test_unsupported_operator_raises():
+    with pytest.raises(NotImplementedError):
+        matches({'a': 1}, {'a': {'$regex': '1'}})
+
+
+def test_find_equality_and_boolean_pushdown(pages):
+    published = run(pages.find({'is_published': True}, {'_id': 0}).to_list(10))
+    assert sorted(page['id'] for page in published) == ['a', 'c']
+    assert run(pages.count_documents({'is_published': False})) == 1
+    assert run(pages.find_one({'slug': 'about'}))['id'] == 'b'
+    assert run(pages.find_one({'slug': 'missing'})) is None
+
+
+def test_find_operators_evaluated_in_python(pages):
+    recent = run(pages.find({'updated_at': {'$gte': '2025-01-02'}}).to_list(10))
+    assert sorted(page['id'] for page in recent) == ['a', 'b']
+    assert run(pages.count_documents({'tags': {'$exists': False}})) == 1
+
+
+def test_scalar_equality_matches_array_elements(pages):
+    assert [page['id'] for page in run(pages.find({'tags': 'x'}).to_list(10))] == ['a']
+    assert run(pages.count_documents({'tags': 'z'})) == 0
+    assert [page['id'] for page in run(pages.find({'tags': {'$in': ['x']}}).to_list(10))] == ['a']
+
+
+def test_array_fields_recorded_by_updates_and_reopen(tmp_path):
+    path = str(tmp_path / 'arrays.sqlite3')
+    database = SQLiteDatabase(path)
+    run(database.items.insert_one({'id': 'a', 'labels': 'x'}))
+    run(database.items.update_one({'id': 'a'}, {'$set': {'labels': ['y', 'z']}}))
+    assert run(database.items.count_documents({'labels': 'z'})) == 1
+    database.close()
+
+    database = SQLiteDatabase(path, read_only=True)
+    assert run(database.items.count_documents({'labels': 'y'})) == 1
+    database.close()
+
+
+def test_array_fields_backfilled_for_older_files(tmp_path):
+    path = str(tmp_path / 'old.sqlite3')
+    database = SQLiteDatabase(path)
+    run(database.items.insert_one({'id': 'a', 'labels': ['x']}))
+    database.close()
+    connection = sqlite3.connect(path)
+    connection.execute('DROP TABLE _array_fields')
+    connection.commit()
+    connection.close()
+
+    database = SQLiteDatabase(path, read_only=True)
+    assert run(database.items.count_documents({'labels': 'x'})) == 1
+    database.close()
+    database = SQLiteDatabase(path)
+    assert run(database.items.count_documents({'labels': 'x'})) == 1
+    database.close()
+
+
+def test_datetimes_and_bytes_round_trip(database):
+    moment = datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+    run(database.rollups.insert_one({'bucket': moment, 'blob': b'\x00\x01'}))
+    stored = run(database.rollups.find_one({'bucket': {'$gte': moment - timedelta(hours=1)}}))
+    assert stored['bucket'] == moment
+    assert stored['blob'] == b'\x00\x01'
+
+
+def test_naive_datetimes_are_stored_as_utc(database):
+    # Motor hands out naive UTC datetimes unless tz_aware is set
+    run(database.rollups.insert_one({'bucket': datetime(2025, 1, 1, 12)}))
+    stored = run(database.rollups.find_one({'bucket': {'$gte': datetime(2025, 1, 1, 11, tzinfo=timezone.utc)}}))
+    assert stored['bucket'] == datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+
+
+# =============== SORT, SKIP, LIMIT, PROJECTION ===============
+
+def test_multi_key_sort_skip_and_limit(pages):
+    ordered = run(pages.find({}).sort([('display_order', 1), ('slug', -1)]).to_list(None))
+    assert [page['id'] for page in ordered] == ['c', 'b', 'a']
+    window = run(pages.find({}).sort('updated_at', -1).skip(1).limit(1).to_list(10))
+    assert [page['id'] for page in window] == ['a']
+
+
+def test_natural_sort_follows_insertion_order(pages):
+    newest_first = run(pages.find({}).sort('$natural', -1).to_list(2))
+    assert [page['id'] for page in newest_first] == ['c', 'b']
+
+
+def test_find_one_with_sort(pages):
+    latest = run(pages.find_one({}, {'_id': 0, 'updated_at': 1}, sort=[('updated_at', -1)]))
+    assert latest == {'updated_at': '2025-01-03'}
+
+
+def test_projection_include_and_exclude(pages):
+    included = run(pages.find_one({'id': 'a'}, {'_id': 0, 'id': 1, 'slug': 1}))
+    assert included == {'id': 'a', 'slug': 'home'}
+    excluded = run(pages.find_one({'id': 'a'}, {'_id': 0, 'tags': 0, 'updated_at': 0}))
+    assert set(excluded) == {'id', 'slug', 'is_published', 'display_order'}
+
+
+def test_async_iteration(pages):
+    async def collect():
+        return [page['id'] async for page in pages.find({'is_published': True}).sort('id', 1)]
+    assert run(collect()) == ['a', 'c']
+
+
+# =============== WRITES ===============
+
+def test_update_one_set_inc_and_upsert(database):
+    collection = database.counters
+    result = run(collection.update_one({'key': 'k'}, {'$inc': {'views': 2}}, upsert=True))
+    assert result.matched_count == 0
+    run(collection.update_one({'key': 'k'}, {'$inc': {'views': 3}, '$set': {'label': 'K'}}, upsert=True))
+    assert run(collection.find_one({'key': 'k'}, {'_id': 0})) == {'key': 'k', 'views': 5, 'label': 'K'}
+    assert run(collection.update_one({'key': 'other'}, {'$set': {'a': 1}})).matched_count == 0
+    assert run(collection.count_documents({})) == 1
+
+
+def test_set_on_insert_only_applies_to_upserted_documents(database):
+    collection = database.leads
+    run(collection.update_one({'email': 'a@b.c'}, {'$setOnInsert': {'name': 'First'}}, upsert=True))
+    run(collection.update_one({'email': 'a@b.c'}, {'$setOnInsert': {'name': 'Second'}}, upsert=True))
+    assert run(collection.find({}, {'_id': 0}).to_list(10)) == [{'email': 'a@b.c', 'name': 'First'}]
+
+
+def test_update_many_and_delete_one(pages):
+    result = run(pages.update_many({'tags': {'$exists': False}}, {'$set': {'tags': []}}))
+    assert result.matched_count == 1
+    assert run(pages.count_documents({'tags': {'$exists': True}})) == 3
+    assert run(pages.delete_one({'id': 'b'})).deleted_count == 1
+    assert run(pages.delete_one({'id': 'b'})).deleted_count == 0
+
+
+def test_bulk_write_update_one_upserts(database):
+    operations = [
+        UpdateOne({'kind': 'page', 'bucket': 1}, {'$inc': {'views': 1}}, upsert=True),
+        UpdateOne({'kind': 'page', 'bucket': 1}, {'$inc': {'views': 4}}, upsert=True),
+    ]
+    run(database.rollups.bulk_write(operations, ordered=False))
+    assert run(database.rollups.find_one({'kind': 'page'}))['views'] == 5
+
+
+def test_bulk_write_reads_pinned_update_one_arguments(database):
+    # The adapter relies on pymongo's private UpdateOne attributes
+    operation = UpdateOne({'kind': 'page'}, {'$set': {'views': 1}}, upsert=True)
+    assert (operation._filter, operation._doc, operation._upsert) == ({'kind': 'page'}, {'$set': {'views': 1}}, True)
+    with pytest.raises(NotImplementedError):
+        run(database.rollups.bulk_write([InsertOne({'kind': 'page'})]))
+
+
+def test_unique_index(database):
+    run(database.users.create_index([('tenant_id', 1), ('email', 1)], unique=True))
+    run(database.users.insert_one({'tenant_id': 't', 'email': 'a@b.co'}))
+    run(database.users.insert_one({'tenant_id': 'u', 'email': 'a@b.co'}))
+    with pytest.raises(sqlite3.IntegrityError):
+        run(database.users.insert_one({'tenant_id': 't', 'email': 'a@b.co'}))
+
+
+def test_capped_collection_keeps_newest(database):
+    run(database.create_collection('profiles', capped=True, size=1024, max=3))
+    for index in range(5):
+        run(database.profiles.insert_one({'i': index}))
+    assert [doc['i'] for doc in run(database.profiles.find({}).sort('$natural', -1).to_list(None))] == [4, 3, 2]
+
+
+def test_read_only_database(tmp_path):
+    path = str(tmp_path / 'replica.sqlite3')
+    writer = SQLiteDatabase(path)
+    run(writer.pages.insert_one({'id': 'a'}))
+    writer.close()
+
+    replica = SQLiteDatabase(path, read_only=True)
+    try:
+        assert run(replica.pages.count_documents({})) == 1
+        assert run(replica.missing.find_one({})) is None
+        with pytest.raises(ReadOnlyStorageError):
+            run(replica.pages.insert_one({'id': 'b'}))
+    finally:
+        replica.close()
+
+
+# =============== AGGREGATION ===============
+
+def test_group_sum_sort_limit_project():
+    documents = [
+        {'kind': 'page', 'item_id': 'a', 'views': 3},
+        {'kind': 'page', 'item_id': 'a', 'views': 2},
+        {'kind': 'portfolio', 'item_id': 'b', 'views': 4},
+        {'kind': 'page', 'item_id': 'c'},
+    ]
+    top = run_pipeline(documents, [
+        {'$group': {'_id': {'kind': '$kind', 'item_id': '$item_id'}, 'views': {'$sum': '$views'}}},
+        {'$sort': {'views': -1}},
+        {'$limit': 2},
+        {'$project': {'_id': 0, 'kind': '$_id.kind', 'item_id': '$_id.item_id', 'views': 1}},
+    ])
+    assert top == [
+        {'kind': 'page', 'item_id': 'a', 'views': 5},
+        {'kind': 'portfolio', 'item_id': 'b', 'views': 4},
+    ]
+
+
+def test_group_with_cond_and_if_null():
+    documents = [
+        {'sections_zlib': b'x', 'sections_hash': 'h', 'sections_size': 100, 'sections_stored_size': 10},
+        {'sections_zlib': None, 'sections_hash': 'h', 'sections_size': 50, 'sections_stored_size': 50},
+        {'sections': []},
+    ]
+    totals = run_pipeline(documents, [
+        {'$group': {
+            '_id': None,
+            'pages': {'$sum': 1},
+            'compressed_pages': {'$sum': {'$cond': [{'$ifNull': ['$sections_zlib', False]}, 1, 0]}},
+            'unmigrated_pages': {'$sum': {'$cond': [{'$ifNull': ['$sections_hash', False]}, 0, 1]}},
+            'raw_bytes': {'$sum': {'$ifNull': ['$sections_size', 0]}},
+        }},
+        {'$project': {'_id': 0}},
+    ])
+    assert totals == [{'pages': 3, 'compressed_pages': 1, 'unmigrated_pages': 1, 'raw_bytes': 150}]
+
+
+def test_aggregate_leading_match_narrows_rows(database):
+    moment = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    run(database.rollups.insert_many([
+        {'tenant_id': 't', 'granularity': 'day', 'bucket': moment, 'views': 2},
+        {'tenant_id': 't', 'granularity': 'day', 'bucket': moment + timedelta(days=1), 'views': 3},
+        {'tenant_id': 'u', 'granularity': 'day', 'bucket': moment, 'views': 100},
+    ]))
+    series = run(database.rollups.aggregate([
+        {'$match': {'tenant_id': 't', 'granularity': 'day', 'bucket': {'$gte': moment}}},
+        {'$group': {'_id': '$bucket', 'views': {'$sum': '$views'}}},
+        {'$sort': {'_id': 1}},
+        {'$project': {'_id': 0, 'bucket': '$_id', 'views': 1}},
+    ]).to_list(None))
+    assert series == [{'bucket': moment, 'views': 2}, {'bucket': moment + timedelta(days=1), 'views': 3}]